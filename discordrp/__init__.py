@@ -2,11 +2,31 @@
 A lightweight and safe module for creating custom rich presences on Discord.
 """
 
+from typing import TYPE_CHECKING, Any
+
 from .presence import ActivityError, ClientIDError, Presence, PresenceError
 
+if TYPE_CHECKING:
+    from .async_presence import AsyncPresence
+
 __title__ = "discord-rich-presence"
 __author__ = "TenType"
 __copyright__ = "Copyright 2022-2023 TenType"
 __license__ = "MIT"
 __version__ = "1.1.0"
-__all__ = ("ActivityError", "ClientIDError", "Presence", "PresenceError")
+__all__ = (
+    "ActivityError",
+    "AsyncPresence",
+    "ClientIDError",
+    "Presence",
+    "PresenceError",
+)
+
+
+def __getattr__(name: str) -> Any:
+    # AsyncPresence imports asyncio, which is slow, so only load it when used
+    if name == "AsyncPresence":
+        from .async_presence import AsyncPresence
+
+        return AsyncPresence
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
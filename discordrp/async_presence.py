@@ -0,0 +1,190 @@
+import asyncio
+import os
+import sys
+
+from typing import Any, Optional, cast
+from types import TracebackType
+
+from . import presence as _presence
+from .presence import (
+    SOCKET_NAME,
+    WINDOWS_PIPE,
+    _HEADER,
+    _OP_CLOSE,
+    _OP_FRAME,
+    _OP_HANDSHAKE,
+    _check_handshake,
+    _check_reply,
+    _get_unix_pipe_path,
+    _pack,
+)
+
+
+class AsyncPresence:
+    """
+    An asyncio version of `Presence` that does not block the event loop while waiting for Discord.
+
+    The connection is opened by `connect()`, or automatically when used with the 'async with' statement.
+    """
+
+    def __init__(self, client_id: str):
+        self.client_id = client_id
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+        # Keeps each request paired with its reply when several tasks use the presence at once.
+        # Created on connect, since before Python 3.10 a lock is bound to the loop it is created in.
+        self._lock: Optional[asyncio.Lock] = None
+
+        # Nonces only need to be unique per connection, so a counter is enough
+        self._nonce = 0
+
+    async def connect(self) -> None:
+        """
+        Connects to Discord and sends a handshake request.
+        """
+        if sys.platform == "win32":
+            self._reader, self._writer = await _open_windows_connection()
+        else:
+            self._reader, self._writer = await _open_unix_connection()
+
+        self._lock = asyncio.Lock()
+        async with self._lock:
+            try:
+                await self._send({"v": 1, "client_id": self.client_id}, _OP_HANDSHAKE)
+                _check_handshake(await self._read())
+            except BaseException:
+                # 'async with' does not call __aexit__ when __aenter__ fails, so clean up here
+                await self._close_writer()
+                raise
+
+    async def set(self, activity: Optional[dict[str, Any]]) -> None:
+        """
+        Sets the current activity using a dictionary representing a [Discord activity object](https://discord.com/developers/docs/topics/gateway-events#activity-object).
+
+        Raises a `PresenceError` if Discord rejected the payload.
+        """
+        self._nonce += 1
+        payload = {
+            "cmd": "SET_ACTIVITY",
+            "args": {
+                "pid": os.getpid(),
+                "activity": activity,
+            },
+            "nonce": str(self._nonce),
+        }
+        async with self._get_lock():
+            await self._send(payload, _OP_FRAME)
+            reply = await self._read()
+
+        # Check for errors
+        _check_reply(reply)
+
+    async def clear(self) -> None:
+        """
+        Clears the current activity.
+        """
+        await self.set(None)
+
+    async def close(self) -> None:
+        """
+        Closes the current connection.
+        This method is automatically called when the program exits using the 'async with' statement.
+        """
+        # Already closed, or never connected
+        if self._writer is None:
+            return
+
+        async with self._get_lock():
+            try:
+                await self._send({}, _OP_CLOSE)
+            finally:
+                await self._close_writer()
+
+    async def _close_writer(self) -> None:
+        writer, self._writer = self._writer, None
+        if writer is None:
+            return
+
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            raise RuntimeError("AsyncPresence is not connected, call connect() first")
+        return self._lock
+
+    def _get_writer(self) -> asyncio.StreamWriter:
+        if self._writer is None:
+            raise RuntimeError("AsyncPresence is not connected, call connect() first")
+        return self._writer
+
+    async def _read(self) -> dict[str, Any]:
+        if self._reader is None:
+            raise RuntimeError("AsyncPresence is not connected, call connect() first")
+        try:
+            op, length = _HEADER.unpack(await self._reader.readexactly(_HEADER.size))
+            data = _presence._loads(await self._reader.readexactly(length))
+        except asyncio.IncompleteReadError as e:
+            raise ConnectionAbortedError(
+                "Connection closed before all bytes were read"
+            ) from e
+        return cast(dict[str, Any], data)
+
+    async def _send(self, payload: dict[str, Any], op: int) -> None:
+        writer = self._get_writer()
+        writer.writelines(_pack(payload, op))
+        await writer.drain()
+
+    async def __aenter__(self) -> "AsyncPresence":
+        await self.connect()
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: Optional[type[BaseException]],
+        exc_value: Optional[BaseException],
+        exc_traceback: Optional[TracebackType],
+    ) -> None:
+        await self.close()
+
+
+async def _open_unix_connection() -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    pipe = os.path.join(_get_unix_pipe_path(), SOCKET_NAME)
+
+    # Try to connect to a socket, starting from 0 up to 9
+    for i in range(10):
+        try:
+            return await asyncio.open_unix_connection(pipe.format(i))  # type: ignore [attr-defined,no-any-return,unused-ignore]
+        except (FileNotFoundError, ConnectionRefusedError):
+            # Skip sockets that are missing or left behind by a Discord that has quit
+            pass
+
+    raise FileNotFoundError("Cannot find a Unix socket to connect to Discord")
+
+
+async def _open_windows_connection() -> (
+    tuple[asyncio.StreamReader, asyncio.StreamWriter]
+):
+    # Named pipes are only supported by the proactor event loop, which is the default on Windows
+    loop = asyncio.get_running_loop()
+    if not hasattr(loop, "create_pipe_connection"):
+        raise RuntimeError("Named pipes require a ProactorEventLoop on Windows")
+
+    # Try to connect to a socket, starting from 0 up to 9
+    for i in range(10):
+        reader = asyncio.StreamReader()
+        protocol = asyncio.StreamReaderProtocol(reader)
+        try:
+            transport, _ = await loop.create_pipe_connection(  # type: ignore [attr-defined,unused-ignore]
+                lambda: protocol, WINDOWS_PIPE.format(i)
+            )
+        except FileNotFoundError:
+            continue
+        return reader, asyncio.StreamWriter(transport, protocol, reader, loop)
+
+    raise FileNotFoundError("Cannot find a Windows socket to connect to Discord")
@@ -1,14 +1,15 @@
-import json
+import errno
+import operator
 import os
-import socket
 import struct
 import sys
+import threading
+import time
 
-from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from enum import IntEnum
-from typing import Any, Optional, cast
+from typing import Any, Callable, Iterator, Optional, cast
 from types import TracebackType
-from uuid import uuid4
 
 
 class _OpCode(IntEnum):
@@ -23,9 +24,60 @@ class _OpCode(IntEnum):
     PONG = 4
 
 
+# Plain ints for the opcodes that are sent, so sending skips the enum lookup and conversion
+_OP_HANDSHAKE = int(_OpCode.HANDSHAKE)
+_OP_FRAME = int(_OpCode.FRAME)
+_OP_CLOSE = int(_OpCode.CLOSE)
+
 SOCKET_NAME = "discord-ipc-{}"
+WINDOWS_PIPE = R"\\.\pipe\\" + SOCKET_NAME
 INVALID_PAYLOAD = 4000
 
+# Every packet starts with a little-endian opcode and payload length
+_HEADER = struct.Struct("<ii")
+
+
+def _use_serializer(prefer_orjson: bool = True) -> None:
+    # Binds _dumps and _loads to orjson if it is installed, or to the standard json module otherwise.
+    # This runs on first use rather than at import time, since importing either module takes a few milliseconds.
+    global _dumps, _loads
+
+    if prefer_orjson:
+        try:
+            import orjson
+        except ImportError:
+            pass
+        else:
+            # orjson returns UTF-8 bytes directly, skipping the intermediate str
+            _dumps = orjson.dumps
+            _loads = orjson.loads
+            return
+
+    import json
+
+    encode = json.JSONEncoder().encode
+
+    def dumps(payload: Any) -> bytes:
+        return encode(payload).encode("utf-8")
+
+    _dumps = dumps
+    _loads = json.loads
+
+
+def _dumps_first(payload: Any) -> bytes:
+    _use_serializer()
+    return _dumps(payload)
+
+
+def _loads_first(data: bytes) -> Any:
+    _use_serializer()
+    return _loads(data)
+
+
+# Rebound by _use_serializer, so always call these through the module rather than importing them by name
+_dumps: Callable[[Any], bytes] = _dumps_first
+_loads: Callable[[bytes], Any] = _loads_first
+
 
 class PresenceError(Exception):
     """
@@ -55,55 +107,160 @@ class ActivityError(PresenceError):
         super().__init__(message, INVALID_PAYLOAD)
 
 
+def _pack(payload: dict[str, Any], op: int) -> list[bytes]:
+    return _pack_bytes(_dumps(payload), op)
+
+
+def _pack_bytes(encoded: bytes, op: int) -> list[bytes]:
+    return [_HEADER.pack(op, len(encoded)), encoded]
+
+
+def _check_handshake(payload: dict[str, Any]) -> None:
+    if payload.get("evt") == "READY":
+        return
+
+    code: int = payload["code"]
+    if code == INVALID_PAYLOAD:
+        raise ClientIDError()
+    raise PresenceError(payload["message"], code)
+
+
+def _check_reply(reply: dict[str, Any]) -> None:
+    if reply.get("evt") != "ERROR":
+        return
+
+    data = reply["data"]
+    message: str = data["message"]
+    code: int = data["code"]
+
+    if code == INVALID_PAYLOAD:
+        # Improve readability of the error message if the dictionary is invalid
+        prefix = 'child "activity" fails because ['
+        if message.startswith(prefix):
+            message = message[len(prefix) : -1]
+        raise ActivityError(message)
+
+    raise PresenceError(message, code)
+
+
+def _get_unix_pipe_path() -> str:
+    for env in ("XDG_RUNTIME_DIR", "TMPDIR", "TMP", "TEMP"):
+        path = os.environ.get(env)
+        if path is not None:
+            return path
+
+    return "/tmp/"
+
+
 class Presence:
     """
     The main class used to connect to Discord for its rich presence API.
     """
 
-    def __init__(self, client_id: str):
+    def __init__(self, client_id: str, min_interval: float = 0.0):
         self.client_id = client_id
+        self.min_interval = min_interval
 
-        # Connect to Discord IPC
-        self._socket: _Socket = (
-            _WindowsSocket() if sys.platform == "win32" else _UnixSocket()
+        # Only the activity and nonce change between SET_ACTIVITY frames, so the rest is encoded once
+        self._activity_prefix = (
+            b'{"cmd":"SET_ACTIVITY","args":{"pid":%d,"activity":' % os.getpid()
         )
-
-        # Send a handshake request
-        self._handshake()
-
-    def set(self, activity: Optional[dict[str, Any]]) -> None:
+        # The encoded activity last sent to Discord, used to skip identical updates
+        self._last_activity: Optional[bytes] = None
+        # Nonces only need to be unique per connection, so a counter is enough
+        self._nonce = 0
+        # Encoded activity fields from set_static, added to every activity
+        self._static_fields: dict[str, bytes] = {}
+        self._header = bytearray(_HEADER.size)
+
+        # Number of updates whose replies have not been read yet
+        self._pending_replies = 0
+
+        # Updates arriving within min_interval of the last one are deferred, keeping only the newest
+        self._lock = threading.Lock()
+        self._last_update = float("-inf")
+        self._deferred_activity = b""
+        self._timer: Optional[threading.Timer] = None
+
+        # Frames held back while inside a batched() block
+        self._batch: Optional[list[bytes]] = None
+
+        self._connected = False
+        self._connect(client_id)
+
+    def set(
+        self, activity: Optional[dict[str, Any]], fire_and_forget: bool = False
+    ) -> None:
         """
         Sets the current activity using a dictionary representing a [Discord activity object](https://discord.com/developers/docs/topics/gateway-events#activity-object).
 
         Raises a `PresenceError` if Discord rejected the payload.
+        If `fire_and_forget` is true, this returns without waiting for Discord's reply, so an error may be raised by a later call to `set` instead.
+
+        If the last update was less than `min_interval` seconds ago, the activity is sent in the background once the interval has passed, unless a newer activity replaces it first.
+        Errors from such updates are raised by a later call to `set`.
+        Setting the same activity that was last sent does nothing.
         """
+        self._set_encoded(self._encode_activity(activity), fire_and_forget)
 
-        payload = {
-            "cmd": "SET_ACTIVITY",
-            "args": {
-                "pid": os.getpid(),
-                "activity": activity,
-            },
-            "nonce": str(uuid4()),
-        }
-        self._send(payload, _OpCode.FRAME)
+    def prepare(self, activity: dict[str, Any]) -> Callable[..., None]:
+        """
+        Encodes an activity ahead of time for updates where only some integers change, such as timestamps.
+        The integers are marked with `...` in the dictionary, e.g. `{"timestamps": {"start": ...}}`.
 
-        # Check for errors
-        reply = self._read()
-        if reply.get("evt") != "ERROR":
-            return
+        Returns a function that takes the integers in the order they appear, and sets the activity like `set` does without encoding it again.
+        The function raises a `TypeError` if given a value that is not an integer.
+        Fields from `set_static` are included as they were when this was called.
+        """
+        markers: list[str] = []
+
+        def mark(value: Any) -> Any:
+            if value is ...:
+                markers.append(f"__discordrp_slot_{len(markers)}__")
+                return markers[-1]
+            if isinstance(value, dict):
+                return {key: mark(item) for key, item in value.items()}
+            if isinstance(value, list):
+                return [mark(item) for item in value]
+            return value
+
+        # Split the encoded activity around the markers, leaving the constant parts
+        segments: list[bytes] = []
+        rest = self._encode_activity(mark(activity))
+        for marker in markers:
+            before, rest = rest.split(b'"%s"' % marker.encode("ascii"), 1)
+            segments.append(before)
+        segments.append(rest)
+
+        def set_prepared(*values: int, fire_and_forget: bool = False) -> None:
+            if len(values) != len(markers):
+                raise TypeError(
+                    f"Expected {len(markers)} values for the prepared activity, got {len(values)}"
+                )
 
-        message: str = reply["data"]["message"]
-        code: int = reply["data"]["code"]
+            parts = [segments[0]]
+            for value, segment in zip(values, segments[1:]):
+                # Reject floats and other non-integers instead of silently truncating them
+                parts += (b"%d" % operator.index(value), segment)
+            self._set_encoded(b"".join(parts), fire_and_forget)
 
-        if code == INVALID_PAYLOAD:
-            # Improve readability of the error message if the dictionary is invalid
-            prefix = 'child "activity" fails because ['
-            if message.startswith(prefix):
-                message = message[len(prefix) : -1]
-            raise ActivityError(message)
+        return set_prepared
 
-        raise PresenceError(message, code)
+    def set_static(
+        self,
+        assets: Optional[dict[str, Any]] = None,
+        buttons: Optional[list[dict[str, str]]] = None,
+    ) -> None:
+        """
+        Sets assets and buttons that are added to every activity passed to `set`, so they are only encoded once.
+        Keys in the activity itself take priority. Takes effect on the next call to `set`.
+        """
+        fields = {"assets": assets, "buttons": buttons}
+        self._static_fields = {
+            key: b'"%s":%s' % (key.encode("ascii"), _dumps(value))
+            for key, value in fields.items()
+            if value is not None
+        }
 
     def clear(self) -> None:
         """
@@ -115,46 +272,219 @@ class Presence:
         """
         Closes the current connection.
         This method is automatically called when the program exits using the 'with' statement.
+        Errors from fire-and-forget updates that have not been raised yet are discarded.
+        """
+        with self._lock:
+            self._disconnect()
+
+    def fileno(self) -> int:
+        """
+        Returns the file descriptor of the connection to Discord, so it can be watched for replies by an event loop.
+        On Windows, this is the handle of the named pipe instead.
+        """
+        return self._socket._fileno()
+
+    def poll(self, timeout: float = 0.0) -> int:
+        """
+        Checks the replies to earlier fire-and-forget updates that have arrived, waiting up to `timeout` seconds for one to arrive.
+
+        Raises a `PresenceError` if Discord rejected one of them.
+        Returns the number of updates that are still waiting for a reply.
         """
+        # Wait without holding the lock, so updates from other threads are not held up
+        if self._pending_replies and self._socket._readable(timeout):
+            with self._lock:
+                self._check_pending_replies(block=False)
+        return self._pending_replies
+
+    def switch(self, client_id: str) -> None:
+        """
+        Switches to another app by reconnecting with a different client ID, keeping the static fields from `set_static`.
+        Errors from fire-and-forget updates that have not been raised yet are discarded.
+        """
+        with self._lock:
+            if self._connected and client_id == self.client_id:
+                return
+
+            self._disconnect()
+            self._pending_replies = 0
+            self._connect(client_id)
+
+    @contextmanager
+    def batched(self) -> Iterator[None]:
+        """
+        Holds back everything sent to Discord inside the 'with' block, and sends it all in a single write when the block exits.
+        Updates inside the block do not wait for Discord's reply, as if `fire_and_forget` was true.
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = []
         try:
-            self._send({}, _OpCode.CLOSE)
+            yield
         finally:
+            with self._lock:
+                self._flush_batch()
+
+    def _flush_batch(self) -> None:
+        buffers, self._batch = self._batch, None
+        if not buffers:
+            return
+
+        try:
+            self._socket._writev(buffers)
+        except OSError:
+            # It is unknown how many of the frames were sent, so stop waiting for their replies
+            self._pending_replies = 0
+            self._last_activity = None
+            raise
+
+    def _write(self, buffers: list[bytes]) -> None:
+        if self._batch is not None:
+            # One buffer per frame, so a batch stays well within the socket's buffer limit
+            self._batch.append(b"".join(buffers))
+        else:
+            self._socket._writev(buffers)
+
+    def _encode_activity(self, activity: Optional[dict[str, Any]]) -> bytes:
+        encoded = _dumps(activity)
+        if activity is None:
+            return encoded
+
+        static = [
+            field for key, field in self._static_fields.items() if key not in activity
+        ]
+        if not static:
+            return encoded
+
+        # Splice the static fields in before the closing brace of the activity
+        separator = b"," if activity else b""
+        return b"".join((encoded[:-1], separator, b",".join(static), b"}"))
+
+    def _set_encoded(self, encoded: bytes, fire_and_forget: bool) -> None:
+        # Only wait for Discord to reply if not fire-and-forget or batched
+        block = not fire_and_forget and self._batch is None
+
+        with self._lock:
+            if encoded == self._last_activity:
+                # Discord already shows this activity, so any deferred update is superseded
+                self._cancel_deferred()
+                self._check_pending_replies(block)
+                return
+
+            delay = self._last_update + self.min_interval - time.monotonic()
+            if delay > 0:
+                self._deferred_activity = encoded
+                # The deadline does not move while a timer is pending, so it can be reused
+                if self._timer is None:
+                    self._timer = threading.Timer(delay, self._send_deferred)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+
+            self._cancel_deferred()
+            self._send_activity(encoded)
+
+            # Check for errors
+            self._check_pending_replies(block)
+
+    def _send_activity(self, encoded: bytes) -> None:
+        self._nonce += 1
+        nonce = b"%d" % self._nonce
+
+        # Hand the pieces of the frame to the socket as they are instead of joining them first
+        parts = [self._activity_prefix, encoded, b'},"nonce":"', nonce, b'"}']
+        length = sum(map(len, parts))
+        self._write([_HEADER.pack(_OP_FRAME, length), *parts])
+        self._pending_replies += 1
+        self._last_activity = encoded
+        self._last_update = time.monotonic()
+
+    def _send_deferred(self) -> None:
+        with self._lock:
+            # The timer may have fired just before being cancelled
+            if self._timer is None:
+                return
+            self._timer = None
+            self._send_activity(self._deferred_activity)
+            self._deferred_activity = b""
+
+    def _cancel_deferred(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._deferred_activity = b""
+
+    def _connect(self, client_id: str) -> None:
+        # Connect to Discord IPC
+        self._socket = _Socket()
+
+        # Send a handshake request, bypassing any batch since the reply is needed right away
+        try:
+            handshake = {"v": 1, "client_id": client_id}
+            self._socket._writev(_pack(handshake, _OP_HANDSHAKE))
+            _check_handshake(self._read())
+        except BaseException:
             self._socket._close()
+            raise
 
-    def _handshake(self) -> None:
-        self._send({"v": 1, "client_id": self.client_id}, _OpCode.HANDSHAKE)
-        payload = self._read()
+        self.client_id = client_id
+        self._connected = True
+        self._last_activity = None
+
+    def _disconnect(self) -> None:
+        # The socket may already be closed by an earlier close() or a failed switch()
+        if not self._connected:
+            return
+
+        self._connected = False
+        self._cancel_deferred()
+        try:
+            self._send({}, _OP_CLOSE)
+            self._flush_batch()
+        finally:
+            self._socket._close()
 
-        if payload.get("evt") != "READY":
-            if payload["code"] == INVALID_PAYLOAD:
-                raise ClientIDError()
-            raise PresenceError(payload["message"], payload["code"])
+    def _check_pending_replies(self, block: bool) -> None:
+        while self._pending_replies and (block or self._socket._readable()):
+            self._pending_replies -= 1
+            try:
+                _check_reply(self._read())
+            except PresenceError:
+                # Send the activity again next time even if it is unchanged
+                self._last_activity = None
+                raise
 
     def _read(self) -> dict[str, Any]:
         op, length = self._read_header()
-        decoded = self._read_bytes(length).decode("utf-8")
-        data = json.loads(decoded)
+        data = _loads(self._read_bytes(length))
         return cast(dict[str, Any], data)
 
     def _read_header(self) -> tuple[int, int]:
-        return cast(tuple[int, int], struct.unpack("<ii", self._read_bytes(8)))
+        # Reuse one header buffer rather than allocating bytes for every packet
+        self._read_exact(memoryview(self._header))
+        return cast(tuple[int, int], _HEADER.unpack_from(self._header))
 
     def _read_bytes(self, size: int) -> bytes:
-        data = b""
-        while size > 0:
-            chunk = self._socket._read(size)
-            if not chunk:
+        # Fill a preallocated buffer in place instead of concatenating chunks
+        data = bytearray(size)
+        self._read_exact(memoryview(data))
+        return bytes(data)
+
+    def _read_exact(self, view: memoryview) -> None:
+        read_into = self._socket._read_into
+        offset = 0
+        while offset < len(view):
+            count = read_into(view[offset:])
+            if not count:
                 raise ConnectionAbortedError(
                     "Connection closed before all bytes were read"
                 )
-            data += chunk
-            size -= len(chunk)
-        return data
+            offset += count
 
-    def _send(self, payload: dict[str, Any], op: _OpCode) -> None:
-        encoded = json.dumps(payload).encode("utf-8")
-        header = struct.pack("<ii", int(op), len(encoded))
-        self._socket._write(header + encoded)
+    def _send(self, payload: dict[str, Any], op: int) -> None:
+        self._write(_pack(payload, op))
 
     def __enter__(self) -> "Presence":
         return self
@@ -168,65 +498,103 @@ class Presence:
         self.close()
 
 
-class _Socket(ABC):
-    @abstractmethod
+class _UnixSocket:
     def __init__(self) -> None:
-        pass
+        # Only needed on Unix, so imported here to keep importing the package fast
+        import selectors
+        import socket
 
-    @abstractmethod
-    def _read(self, size: int) -> bytes:
-        pass
+        pipe = os.path.join(_get_unix_pipe_path(), SOCKET_NAME)
 
-    @abstractmethod
-    def _write(self, data: bytes) -> None:
-        pass
+        # Start connecting to every socket from 0 up to 9 at once, dropping missing or stale ones
+        opened: list[socket.socket] = []
+        connecting: list[socket.socket] = []
+        connected: Optional[socket.socket] = None
+        try:
+            for i in range(10):
+                path = pipe.format(i)
+
+                # Most of these do not exist, so avoid opening a socket just to find that out
+                if not os.path.exists(path):
+                    continue
+
+                sock = socket.socket(socket.AF_UNIX)  # type: ignore [attr-defined,unused-ignore]
+                opened.append(sock)
+                sock.setblocking(False)
+                result = sock.connect_ex(path)
+                if result == errno.EAGAIN:
+                    # The listen backlog is full, so wait for room like a blocking connect does
+                    sock.setblocking(True)
+                    result = sock.connect_ex(path)
+                    sock.setblocking(False)
+                if result in (0, errno.EINPROGRESS):
+                    connecting.append(sock)
+
+            # Use the lowest-numbered socket that finished connecting.
+            # A selector is used since select() cannot handle file descriptors above 1023.
+            ready = set()
+            if connecting:
+                with selectors.DefaultSelector() as selector:
+                    for sock in connecting:
+                        selector.register(sock, selectors.EVENT_WRITE)
+                    ready = {key.fileobj for key, _ in selector.select(1.0)}
+
+            for sock in connecting:
+                if (
+                    sock in ready
+                    and sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR) == 0
+                ):
+                    connected = sock
+                    break
+        finally:
+            for sock in opened:
+                if sock is not connected:
+                    sock.close()
 
-    @abstractmethod
-    def _close(self) -> None:
-        pass
+        if connected is None:
+            raise FileNotFoundError("Cannot find a Unix socket to connect to Discord")
 
+        connected.setblocking(True)
+        self._sock = connected
 
-class _UnixSocket(_Socket):
-    def __init__(self) -> None:
-        pipe = os.path.join(self._get_pipe_path(), SOCKET_NAME)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
 
-        # Try to connect to a socket, starting from 0 up to 9
-        for i in range(10):
-            try:
-                self._sock = socket.socket(socket.AF_UNIX)  # type: ignore [attr-defined,unused-ignore]
-                self._sock.connect(pipe.format(i))
-                break
-            except FileNotFoundError:
-                pass
-        else:
-            raise FileNotFoundError("Cannot find a Unix socket to connect to Discord")
+        # sendmsg fails with EMSGSIZE when given more buffers than this
+        iov_max = os.sysconf("SC_IOV_MAX")  # type: ignore [attr-defined,unused-ignore]
+        self._iov_max = iov_max if iov_max > 0 else 16
 
-    def _get_pipe_path(self) -> str:
-        for env in ("XDG_RUNTIME_DIR", "TMPDIR", "TMP", "TEMP"):
-            path = os.environ.get(env)
-            if path is not None:
-                return path
+    def _read_into(self, view: memoryview) -> int:
+        return self._sock.recv_into(view)
 
-        return "/tmp/"
+    def _readable(self, timeout: float = 0.0) -> bool:
+        return bool(self._selector.select(timeout))
 
-    def _read(self, size: int) -> bytes:
-        return self._sock.recv(size)
+    def _fileno(self) -> int:
+        return self._sock.fileno()
 
-    def _write(self, data: bytes) -> None:
-        self._sock.sendall(data)
+    def _writev(self, buffers: list[bytes]) -> None:
+        # Send the buffers without joining them first, as few syscalls as sendmsg allows
+        for start in range(0, len(buffers), self._iov_max):
+            chunk = buffers[start : start + self._iov_max]
+            sent = self._sock.sendmsg(chunk)  # type: ignore [attr-defined,unused-ignore]
+            if sent < sum(map(len, chunk)):
+                self._sock.sendall(b"".join(chunk)[sent:])
 
     def _close(self) -> None:
+        self._selector.close()
         self._sock.close()
 
 
-class _WindowsSocket(_Socket):
+class _WindowsSocket:
     def __init__(self) -> None:
-        pipe = R"\\.\pipe\\" + SOCKET_NAME
+        pipe = WINDOWS_PIPE
 
         # Try to connect to a socket, starting from 0 up to 9
         for i in range(10):
             try:
-                self._buffer = open(pipe.format(i), "rb+")
+                # Unbuffered, so replies never sit in Python's buffer where PeekNamedPipe cannot see them
+                self._pipe = open(pipe.format(i), "rb+", buffering=0)
                 break
             except FileNotFoundError:
                 pass
@@ -235,12 +603,48 @@ class _WindowsSocket(_Socket):
                 "Cannot find a Windows socket to connect to Discord"
             )
 
-    def _read(self, size: int) -> bytes:
-        return self._buffer.read(size)
+    def _read_into(self, view: memoryview) -> int:
+        return self._pipe.readinto(view) or 0
+
+    def _readable(self, timeout: float = 0.0) -> bool:
+        # Named pipes cannot be used with selectors, so peek at the pipe until the timeout passes
+        deadline = time.monotonic() + timeout
+        while not self._peek():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _peek(self) -> bool:
+        import ctypes
+
+        available = ctypes.c_ulong(0)
+        ok = ctypes.windll.kernel32.PeekNamedPipe(  # type: ignore [attr-defined,unused-ignore]
+            self._fileno(), None, 0, None, ctypes.byref(available), None
+        )
+        return bool(ok) and available.value > 0
+
+    def _fileno(self) -> int:
+        import msvcrt
+
+        return msvcrt.get_osfhandle(self._pipe.fileno())  # type: ignore [attr-defined,no-any-return,unused-ignore]
 
     def _write(self, data: bytes) -> None:
-        self._buffer.write(data)
-        self._buffer.flush()
+        # Unbuffered writes may be partial, so keep writing until the whole frame is sent
+        view = memoryview(data)
+        while view:
+            view = view[self._pipe.write(view) or 0 :]
+
+    def _writev(self, buffers: list[bytes]) -> None:
+        # Named pipes have no scatter/gather write, so join the buffers instead
+        self._write(b"".join(buffers))
 
     def _close(self) -> None:
-        self._buffer.close()
+        self._pipe.close()
+
+
+# The platform is known up front, so pick its socket class once
+if sys.platform == "win32":
+    _Socket = _WindowsSocket
+else:
+    _Socket = _UnixSocket
@@ -25,4 +25,5 @@ setup(
     ],
     python_requires=">=3.9",
     package_data={"discordrp": ["py.typed"]},
+    extras_require={"fast": ["orjson"]},
 )
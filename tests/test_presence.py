@@ -0,0 +1,303 @@
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import unittest
+
+from typing import Any
+from unittest import mock
+
+from discordrp import ActivityError, Presence, presence
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FakeDiscord:
+    """
+    A local Discord IPC server that records every frame it receives.
+    Handshakes get a READY reply and activities with the state "err" are rejected like an invalid payload.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.frames: list[tuple[int, dict[str, Any]]] = []
+        self._changed = threading.Condition()
+
+        self._server = socket.socket(socket.AF_UNIX)
+        self._server.bind(os.path.join(directory, "discord-ipc-0"))
+        self._server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def activities(self, timeout: float = 5.0, count: int = 0) -> list[Any]:
+        # Waits until at least `count` activities have been received
+        with self._changed:
+            self._changed.wait_for(
+                lambda: len(self._activities()) >= count, timeout=timeout
+            )
+            return self._activities()
+
+    def close(self) -> None:
+        self._server.close()
+
+    def _activities(self) -> list[Any]:
+        return [
+            payload["args"]["activity"]
+            for op, payload in self.frames
+            if op == presence._OP_FRAME
+        ]
+
+    def _accept(self) -> None:
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn: socket.socket) -> None:
+        try:
+            self._serve(conn)
+        except ConnectionError:
+            # The client may close the connection at any point, such as when a test fails
+            pass
+
+    def _serve(self, conn: socket.socket) -> None:
+        with conn, conn.makefile("rb") as file:
+            while True:
+                header = file.read(8)
+                if len(header) < 8:
+                    return
+                op, length = struct.unpack("<ii", header)
+                # The standard json module is strict, so this also checks the client sent valid JSON
+                payload = json.loads(file.read(length))
+
+                with self._changed:
+                    self.frames.append((op, payload))
+                    self._changed.notify_all()
+
+                if op == presence._OP_HANDSHAKE:
+                    reply: dict[str, Any] = {"evt": "READY"}
+                elif op == presence._OP_FRAME:
+                    reply = {"cmd": "SET_ACTIVITY", "nonce": payload["nonce"]}
+                    activity = payload["args"]["activity"]
+                    if activity and activity.get("state") == "err":
+                        message = 'child "activity" fails because [state is invalid]'
+                        reply = {
+                            "evt": "ERROR",
+                            "data": {"code": 4000, "message": message},
+                        }
+                else:
+                    return
+
+                body = json.dumps(reply).encode("utf-8")
+                conn.sendall(struct.pack("<ii", 1, len(body)) + body)
+
+
+@unittest.skipIf(sys.platform == "win32", "uses a Unix socket as the fake Discord")
+class PresenceTest(unittest.TestCase):
+    prefer_orjson = False
+
+    def setUp(self) -> None:
+        presence._use_serializer(self.prefer_orjson)
+        self.addCleanup(self._reset_serializer)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        environ = mock.patch.dict(os.environ, {"XDG_RUNTIME_DIR": directory.name})
+        environ.start()
+        self.addCleanup(environ.stop)
+
+        self.discord = FakeDiscord(directory.name)
+        self.addCleanup(self.discord.close)
+
+    def _reset_serializer(self) -> None:
+        presence._dumps = presence._dumps_first
+        presence._loads = presence._loads_first
+
+    def connect(self, min_interval: float = 0.0) -> Presence:
+        rp = Presence("123", min_interval=min_interval)
+        self.addCleanup(rp.close)
+        # Fail instead of hanging if the client waits for a reply that never comes
+        rp._socket._sock.settimeout(5.0)
+        return rp
+
+    def test_set(self) -> None:
+        rp = self.connect()
+        rp.set({"state": "Playing", "details": "é ☃", "timestamps": {"start": 1}})
+        rp.clear()
+
+        self.assertEqual(
+            self.discord.activities(),
+            [{"state": "Playing", "details": "é ☃", "timestamps": {"start": 1}}, None],
+        )
+        nonces = [payload.get("nonce") for op, payload in self.discord.frames[1:]]
+        self.assertEqual(nonces, ["1", "2"])
+
+    def test_set_static(self) -> None:
+        rp = self.connect()
+        rp.set_static(
+            assets={"large_image": "logo"},
+            buttons=[{"label": "Website", "url": "https://example.com"}],
+        )
+        rp.set({"state": "One"})
+        rp.set({})
+        rp.set({"state": "Two", "assets": {"small_image": "icon"}})
+
+        self.assertEqual(
+            self.discord.activities(),
+            [
+                {
+                    "state": "One",
+                    "assets": {"large_image": "logo"},
+                    "buttons": [{"label": "Website", "url": "https://example.com"}],
+                },
+                {
+                    "assets": {"large_image": "logo"},
+                    "buttons": [{"label": "Website", "url": "https://example.com"}],
+                },
+                {
+                    "state": "Two",
+                    "assets": {"small_image": "icon"},
+                    "buttons": [{"label": "Website", "url": "https://example.com"}],
+                },
+            ],
+        )
+
+    def test_prepare(self) -> None:
+        rp = self.connect()
+        rp.set_static(assets={"large_image": "logo"})
+        update = rp.prepare(
+            {"state": "Level", "party": {"size": [..., 4]}, "timestamps": {"end": ...}}
+        )
+        update(2, 1700000000)
+        update(3, -1)
+
+        self.assertEqual(
+            self.discord.activities(),
+            [
+                {
+                    "state": "Level",
+                    "party": {"size": [2, 4]},
+                    "timestamps": {"end": 1700000000},
+                    "assets": {"large_image": "logo"},
+                },
+                {
+                    "state": "Level",
+                    "party": {"size": [3, 4]},
+                    "timestamps": {"end": -1},
+                    "assets": {"large_image": "logo"},
+                },
+            ],
+        )
+
+    def test_prepare_rejects_non_integers(self) -> None:
+        rp = self.connect()
+        update = rp.prepare({"timestamps": {"start": ...}})
+
+        with self.assertRaises(TypeError):
+            update(1.5)
+        with self.assertRaises(TypeError):
+            update(1, 2)
+        self.assertEqual(self.discord.activities(), [])
+
+    def test_same_activity_is_skipped(self) -> None:
+        rp = self.connect()
+        rp.set({"state": "Idle"})
+        rp.set({"state": "Idle"})
+
+        self.assertEqual(self.discord.activities(), [{"state": "Idle"}])
+
+    def test_rejected_activity_is_sent_again(self) -> None:
+        rp = self.connect()
+        for _ in range(2):
+            with self.assertRaisesRegex(ActivityError, r"^state is invalid$"):
+                rp.set({"state": "err"})
+
+        self.assertEqual(self.discord.activities(), [{"state": "err"}] * 2)
+
+    def test_min_interval_sends_only_the_newest(self) -> None:
+        rp = self.connect(min_interval=0.2)
+        rp.set({"state": "0"})
+        rp.set({"state": "1"})
+        timer = rp._timer
+        self.assertIsNotNone(timer)
+        rp.set({"state": "2"})
+        rp.set({"state": "3"})
+        # Later updates replace the deferred activity without starting another timer
+        self.assertIs(rp._timer, timer)
+
+        self.assertEqual(
+            self.discord.activities(count=2), [{"state": "0"}, {"state": "3"}]
+        )
+
+    def test_min_interval_cancelled_by_same_activity(self) -> None:
+        rp = self.connect(min_interval=0.2)
+        rp.set({"state": "0"})
+        rp.set({"state": "1"})
+        rp.set({"state": "0"})
+        self.assertIsNone(rp._timer)
+
+        self.assertEqual(self.discord.activities(timeout=0.4), [{"state": "0"}])
+
+    def test_batched(self) -> None:
+        rp = self.connect()
+        writev = mock.Mock(wraps=rp._socket._writev)
+        rp._socket._writev = writev
+
+        with rp.batched():
+            for i in range(100):
+                rp.set({"state": str(i)})
+            writev.assert_not_called()
+
+        writev.assert_called_once()
+        while rp.poll(timeout=1.0):
+            pass
+        self.assertEqual(
+            self.discord.activities(count=100), [{"state": str(i)} for i in range(100)]
+        )
+
+    def test_batched_error_in_reply(self) -> None:
+        rp = self.connect()
+        with rp.batched():
+            rp.set({"state": "err"})
+
+        with self.assertRaises(ActivityError):
+            while rp.poll(timeout=1.0):
+                pass
+        # The error reset the last activity, so the same activity is sent again.
+        # The fire-and-forget call itself may raise if the reply arrives quickly enough.
+        with self.assertRaises(ActivityError):
+            rp.set({"state": "err"}, fire_and_forget=True)
+            rp.set({"state": "ok"})
+        self.assertEqual(self.discord.activities()[:2], [{"state": "err"}] * 2)
+
+    def test_batched_write_error(self) -> None:
+        rp = self.connect()
+        writev = rp._socket._writev
+        rp._socket._writev = mock.Mock(side_effect=OSError("write failed"))
+
+        with self.assertRaises(OSError):
+            with rp.batched():
+                for i in range(3):
+                    rp.set({"state": str(i)})
+        self.assertEqual(rp._pending_replies, 0)
+
+        # Nothing reached Discord, so the last activity is sent again instead of waiting for lost replies
+        rp._socket._writev = writev
+        rp.set({"state": "2"})
+        self.assertEqual(rp._pending_replies, 0)
+        self.assertEqual(self.discord.activities(), [{"state": "2"}])
+
+
+@unittest.skipIf(orjson is None, "orjson is not installed")
+class OrjsonPresenceTest(PresenceTest):
+    prefer_orjson = True
+
+
+if __name__ == "__main__":
+    unittest.main()